@@ -0,0 +1,234 @@
+''' Shared request layer for the Megaport and F5 pollers
+Limits how long a run waits on an API that is degraded:
+  - each run has a deadline budget; a call's timeout is capped by what is
+    left of it, and the caller stops waiting once it is spent
+  - idempotent GETs slower than their observed p95 get one hedged retry
+  - each endpoint has a circuit breaker so a dead API fails fast
+Every request runs in a daemon thread. A request abandoned at the deadline
+may keep going in the background until its own socket timeout fires,
+since requests' timeout only bounds connect and per-read waits. It never
+holds the process open at exit.
+Errors are raised as requests.exceptions.RequestException subclasses so the
+existing `except requests.exceptions.RequestException` handlers keep working.
+'''
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+
+import requests
+
+# Methods that are safe to send twice
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class DeadlineExceeded(requests.exceptions.RequestException):
+    '''The per-run deadline budget is used up.'''
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    '''The endpoint's circuit breaker is open, the call was not attempted.'''
+
+
+class CircuitBreaker:
+    '''
+    Consecutive-failure breaker for a single endpoint.
+    closed    - calls go through, opens after `failure_threshold` failures in a row
+    open      - calls are rejected until `reset_after` seconds have passed
+    half_open - a single trial call is let through; success closes the
+                breaker, failure re-opens it, other callers are rejected
+    '''
+
+    def __init__(self, failure_threshold=3, reset_after=30):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        '''Call ended without telling us anything about the endpoint.'''
+        with self.lock:
+            self.trial_in_flight = False
+
+
+class ResilientRequests:
+    '''
+    Deadline-aware wrapper around requests.request shared by a single run.
+
+    deadline          - seconds the whole run may wait on API calls
+    timeout           - upper bound for any single call
+    hedge_min_samples - latency samples needed before GETs are hedged
+    failure_threshold - consecutive failures before an endpoint's breaker opens
+    reset_after       - seconds an open breaker waits before a trial call
+    '''
+
+    def __init__(self, deadline=60, timeout=5, hedge_min_samples=5,
+                 failure_threshold=3, reset_after=30, sample_size=50):
+        self.deadline_at = time.monotonic() + deadline
+        self.timeout = timeout
+        self.hedge_min_samples = hedge_min_samples
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.sample_size = sample_size
+        self.latencies = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        '''Seconds left in the run's deadline budget.'''
+        return max(0.0, self.deadline_at - time.monotonic())
+
+    def p95(self, endpoint):
+        '''Observed p95 latency for an endpoint, None until enough samples exist.'''
+        with self.lock:
+            samples = sorted(self.latencies.get(endpoint, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        '''
+        Send a request within the run's deadline budget.
+        `endpoint` names the breaker/latency bucket; pass one when the URL
+        embeds IDs so calls to the same API path share their history.
+        Returns the requests.Response; raises DeadlineExceeded,
+        CircuitOpenError or the underlying RequestException.
+        '''
+        method = method.upper()
+        if endpoint is None:
+            endpoint = f'{method} {urlparse(url).netloc}'
+        breaker = self._breaker(endpoint)
+
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f'Run deadline exceeded before {method} {endpoint}')
+        if not breaker.allow():
+            raise CircuitOpenError(f'Circuit open for {endpoint}, skipping {url}')
+
+        try:
+            if method in IDEMPOTENT_METHODS and self.p95(endpoint) is not None:
+                response, elapsed = self._hedged(method, url, endpoint, kwargs)
+            else:
+                response, elapsed = self._single(method, url, endpoint, kwargs)
+        except DeadlineExceeded:
+            # out of budget says nothing about the endpoint's health
+            breaker.release()
+            raise
+        except requests.exceptions.RequestException:
+            breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            self._record_latency(endpoint, elapsed)
+        return response
+
+    def _breaker(self, endpoint):
+        with self.lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_after)
+            return self.breakers[endpoint]
+
+    def _record_latency(self, endpoint, elapsed):
+        with self.lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=self.sample_size)).append(elapsed)
+
+    def _send(self, method, url, kwargs):
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f'Run deadline exceeded before {method} {url}')
+        timeout = min(kwargs.pop('timeout', self.timeout), remaining)
+        start = time.monotonic()
+        response = requests.request(method, url, timeout=timeout, **kwargs)
+        return response, time.monotonic() - start
+
+    def _submit(self, method, url, kwargs):
+        '''Run _send in a daemon thread so an abandoned call cannot block exit.'''
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._send(method, url, dict(kwargs)))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _single(self, method, url, endpoint, kwargs):
+        future = self._submit(method, url, kwargs)
+        done, _ = wait([future], timeout=self.remaining())
+        if not done:
+            raise DeadlineExceeded(f'Run deadline exceeded during {method} {endpoint}')
+        return future.result()
+
+    def _hedged(self, method, url, endpoint, kwargs):
+        '''
+        Send the GET, and a second copy if the first is slower than p95 or
+        fails quickly. The first copy to return a non-5xx response wins; a
+        5xx is only returned if both copies fail.
+        '''
+        hedge_delay = self.p95(endpoint)
+        pending = {self._submit(method, url, kwargs)}
+        hedged = False
+        last_response = None
+        error = None
+
+        while pending:
+            if not hedged:
+                timeout = min(hedge_delay, self.remaining())
+            else:
+                timeout = self.remaining()
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    response, elapsed = future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+                    continue
+                if response.status_code < 500:
+                    return response, elapsed
+                last_response = (response, elapsed)
+
+            if not hedged and self.remaining() > 0:
+                logging.info("Hedging %s %s (p95 %.2fs)", method, endpoint, hedge_delay)
+                pending.add(self._submit(method, url, kwargs))
+                hedged = True
+            elif not done:
+                raise DeadlineExceeded(f'Run deadline exceeded during {method} {endpoint}')
+
+        if last_response is not None:
+            return last_response
+        raise error
@@ -0,0 +1,132 @@
+''' Tests for the shared request layer
+requests.request is replaced with a stub that sleeps and returns a canned
+status code, so no network is needed. Run from the repo root with:
+python -m unittest common.test_resilient_requests
+'''
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import resilient_requests
+from common.resilient_requests import ResilientRequests, CircuitBreaker, DeadlineExceeded
+
+
+class StubResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class StubRequests:
+    '''Stands in for requests.request, replies are (delay, status_code) in call order.'''
+
+    def __init__(self):
+        self.replies = []
+
+    def __call__(self, method, url, timeout=None, **kwargs):
+        delay, status_code = self.replies.pop(0)
+        time.sleep(delay)
+        return StubResponse(status_code)
+
+
+class ResilientRequestsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubRequests()
+        patcher = mock.patch.object(resilient_requests.requests, "request", self.stub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def warm(self, client, endpoint):
+        '''Record enough fast samples that GETs to the endpoint get hedged.'''
+        for _ in range(client.hedge_min_samples):
+            self.stub.replies.append((0.01, 200))
+            client.request("GET", "http://mp/", endpoint=endpoint)
+
+    def test_slow_primary_loses_to_hedge(self):
+        client = ResilientRequests(deadline=10, timeout=10)
+        self.warm(client, "get")
+        self.stub.replies += [(3, 200), (0.01, 200)]
+        start = time.monotonic()
+        response = client.request("GET", "http://mp/", endpoint="get")
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_fast_5xx_loses_to_hedged_200(self):
+        client = ResilientRequests(deadline=10, timeout=10)
+        self.warm(client, "get")
+        self.stub.replies += [(0, 503), (0.05, 200)]
+        response = client.request("GET", "http://mp/", endpoint="get")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client._breaker("get").failures, 0)
+
+    def test_5xx_returned_only_when_both_copies_fail(self):
+        client = ResilientRequests(deadline=10, timeout=10)
+        self.warm(client, "get")
+        self.stub.replies += [(0, 503), (0, 502)]
+        response = client.request("GET", "http://mp/", endpoint="get")
+        self.assertGreaterEqual(response.status_code, 500)
+        self.assertEqual(client._breaker("get").failures, 1)
+
+    def test_deadline_during_hedge_leaves_breaker_closed(self):
+        client = ResilientRequests(deadline=0.5, timeout=10)
+        self.warm(client, "get")
+        self.stub.replies += [(3, 200), (3, 200)]
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            client.request("GET", "http://mp/", endpoint="get")
+        self.assertLess(time.monotonic() - start, 0.7)
+        breaker = client._breaker("get")
+        self.assertEqual((breaker.state, breaker.failures), ("closed", 0))
+
+    def test_deadline_during_put_leaves_breaker_closed(self):
+        client = ResilientRequests(deadline=0.3, timeout=10)
+        self.stub.replies.append((3, 200))
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            client.request("PUT", "http://mp/", endpoint="put")
+        self.assertLess(time.monotonic() - start, 0.5)
+        breaker = client._breaker("put")
+        self.assertEqual((breaker.state, breaker.failures), ("closed", 0))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def open_and_wait(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_after=0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        return breaker
+
+    def test_half_open_admits_one_caller(self):
+        breaker = self.open_and_wait()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_trial_failure_reopens(self):
+        breaker = self.open_and_wait()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_trial_success_closes(self):
+        breaker = self.open_and_wait()
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_release_frees_the_trial(self):
+        breaker = self.open_and_wait()
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
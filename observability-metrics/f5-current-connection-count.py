@@ -6,6 +6,9 @@ import requests
 from requests.auth import HTTPBasicAuth
 from datadog import initialize, statsd
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.resilient_requests import ResilientRequests
 #from nested_lookup import nested_lookup
 #import time
 
@@ -22,6 +25,8 @@ f.close()
 host = "hostip"
 # Datadog API Key
 api_key = os.getenv('DD_API_KEY')
+# Seconds the run may spend waiting on the BigIP API
+run_deadline = 30
 
 # Set DD options for statsd init
 options = {
@@ -33,7 +38,13 @@ initialize(**options)
 
 # F5 iControl API - Get URL to access stats. Use Basic Auth
 virtual_stats_url = 'https://' + host +'/mgmt/tm/ltm/virtual/stats'
-virtual_stats_response = requests.get(virtual_stats_url, verify=False, auth=HTTPBasicAuth(username, password))
+client = ResilientRequests(deadline=run_deadline, timeout=10)
+try:
+    virtual_stats_response = client.request("GET", virtual_stats_url, endpoint="f5:virtual_stats", verify=False, auth=HTTPBasicAuth(username, password))
+    virtual_stats_response.raise_for_status()
+except requests.exceptions.RequestException as e:
+    print(e)
+    sys.exit(1)
 
 # convert requests response to json
 virtual_stats_json = virtual_stats_response.json()
@@ -8,7 +8,10 @@ from pprint import pprint
 import requests
 import argparse
 import time
+import sys
 import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.resilient_requests import ResilientRequests
 
 # You will typically want to set these as Environment vars
 # You can use AWS Secrets Manager for these
@@ -17,6 +20,7 @@ parser.add_argument("-u", "--username", required=False, default=os.getenv("MP_US
 parser.add_argument("-p", "--password", required=False, default=os.getenv("MP_PASSWORD"), help="Megaport password")
 parser.add_argument("-k", "--key", required=False, default=os.getenv("DD_API_KEY"), help="DataDog API key")
 parser.add_argument("-m", "--metric", required=False, default="megaport", help="DataDog Metric prefix e.g. megaport")
+parser.add_argument("-d", "--deadline", required=False, type=float, default=os.getenv("RUN_DEADLINE", 60), help="Seconds the whole run may spend on Megaport API calls")
 args = parser.parse_args()
 
 # DataDog config and initialization
@@ -33,9 +37,16 @@ mp_auth_url = "https://auth-m2m.megaport.com/oauth2/token"
 mp_auth_payload = 'grant_type=client_credentials'
 mp_auth_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
 
+# Shared request layer - bounds the run to args.deadline seconds
+client = ResilientRequests(deadline=float(args.deadline), timeout=10)
+
 # Error handling for MP login
 try:
-    create_token_response = requests.request("POST", mp_auth_url, headers=mp_auth_headers, data=mp_auth_payload, auth=(args.username, args.password))
+    create_token_response = client.request("POST", mp_auth_url, endpoint="megaport:token", headers=mp_auth_headers, data=mp_auth_payload, auth=(args.username, args.password))
+except requests.exceptions.RequestException as e:
+    print(e)
+    exit(1)
+try:
     login_token = create_token_response.json()['access_token']
 except:
     print(create_token_response.text)
@@ -46,7 +57,11 @@ mp_headers = {'Authorization': f'Bearer {login_token}'}
 
 ## get list of all megaport products
 try:
-    list_response = requests.request("GET", mp_url+"/products", headers=mp_headers)
+    list_response = client.request("GET", mp_url+"/products", endpoint="megaport:products", headers=mp_headers)
+except requests.exceptions.RequestException as e:
+    print(e)
+    exit(1)
+try:
     list_response = list_response.json()
 except:
     print(list_response.text)
@@ -73,6 +88,9 @@ epoch_current = int(time.time() * 1000)
 # epoch_to = epoch_current - 600000
 epoch_to = epoch_current - 1800000
 
+# Products whose telemetry could not be fetched this run
+failed_products = []
+
 # Get bandwidth metrics for products
 for u in product_metrics:
     # default tags we want to set
@@ -80,9 +98,18 @@ for u in product_metrics:
     product_uid = "product_uid:{}".format(u)
     custom_tags = ["source:megaport_datadog.py", product_name, product_uid]
     
-    telemetry_response = requests.request("GET", "{mp_url}/product/mcr2/{product_uid}/telemetry?type=BITS&to={to_time}&from={from_time}".format(mp_url=mp_url, product_uid=u, to_time=epoch_current, from_time=epoch_to), headers=mp_headers)
-    # print(telemetry_response)
-    raw_data = telemetry_response.json()["data"]
+    # A slow or failing product is skipped so the rest still get sent
+    try:
+        telemetry_response = client.request("GET", "{mp_url}/product/mcr2/{product_uid}/telemetry?type=BITS&to={to_time}&from={from_time}".format(mp_url=mp_url, product_uid=u, to_time=epoch_current, from_time=epoch_to), endpoint="megaport:telemetry", headers=mp_headers)
+        # print(telemetry_response)
+        telemetry_response.raise_for_status()
+        raw_data = telemetry_response.json()["data"]
+        if not isinstance(raw_data, list):
+            raise TypeError("unexpected telemetry data: {!r}".format(raw_data))
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+        print("Skipping telemetry for {}: {}".format(product_metrics[u]["product_name"], e))
+        failed_products.append(u)
+        continue
 
     product_metrics[u].update({"raw_data": raw_data,
                             "mbps_in_samples": [],
@@ -116,3 +143,8 @@ for u in product_metrics:
 # statsd.gauge("megaport.mcrtelemetry.inbound.mbps", mcr_in_mbps, tags=["env:prod", "team-name:network", "project:megaport", "task:mcr-telemetry", "type:inbound-usage-mbps"])
 # # send mcr out bandwidth metrci
 # statsd.gauge("megaport.mcrtelemetry.outbound.mbps", mcr_out_mbps, tags=["env:prod", "team-name:network", "project:megaport", "task:mcr-telemetry", "type:outbound-usage-mbps"])
+
+# Partial results were sent above, still flag the run as failed
+if failed_products:
+    print("Telemetry failed for {} of {} products".format(len(failed_products), len(product_metrics)))
+    exit(1)
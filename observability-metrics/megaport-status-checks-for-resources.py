@@ -3,10 +3,16 @@ import requests
 import logging
 import warnings
 import sys
+import os
 from datadog import initialize, statsd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.resilient_requests import ResilientRequests
 warnings.filterwarnings('ignore')
 
-def create_megaport_session():
+# Total seconds a poll cycle may spend on Megaport API calls
+run_deadline = 30
+
+def create_megaport_session(client):
     '''Create a session with Megaport API and return the access token.'''
     mp_auth_url = "https://auth-m2m.megaport.com/oauth2/token"
     mp_auth_payload = 'grant_type=client_credentials'
@@ -16,21 +22,21 @@ def create_megaport_session():
 
     # Error handling for MP login
     try:
-        create_token_response = requests.request("POST", mp_auth_url, headers=mp_auth_headers, data=mp_auth_payload, auth=(username, password), timeout=5)
+        create_token_response = client.request("POST", mp_auth_url, endpoint="megaport:token", headers=mp_auth_headers, data=mp_auth_payload, auth=(username, password))
         logging.info("Megaport login response: %s", create_token_response.status_code)
         return create_token_response.json()['access_token']
     except requests.exceptions.RequestException as e:
         logging.error("Error: %s", e)
         sys.exit(1)
 
-def megaport_get_something(mp_url, mp_query, login_token):
+def megaport_get_something(client, mp_url, mp_query, login_token):
     '''Get something from Megaport API.'''
 
     ## set headers for future MP requests
     mp_headers = {'Authorization': f'Bearer {login_token}'}
 
     try:
-        mp_response = requests.request("GET", mp_url + mp_query, headers=mp_headers, timeout=5)
+        mp_response = client.request("GET", mp_url + mp_query, endpoint="megaport:" + mp_query.split("?")[0], headers=mp_headers)
         logging.info("Megaport GET Request: %s and Response: %s", mp_query, mp_response.status_code)
         return mp_response.json()
     except requests.exceptions.RequestException as e:
@@ -59,8 +65,9 @@ def main():
         logging.error("Error initializing Datadog: %s", e)
         sys.exit(1)
 
-    login_token = create_megaport_session()
-    data = megaport_get_something("https://api.megaport.com/v2", "/products?provisioningStatus=LIVE", login_token)
+    client = ResilientRequests(deadline=run_deadline, timeout=5)
+    login_token = create_megaport_session(client)
+    data = megaport_get_something(client, "https://api.megaport.com/v2", "/products?provisioningStatus=LIVE", login_token)
     
     resource_list = []
 
@@ -8,6 +8,9 @@ import warnings
 import os
 import yaml
 import json
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.resilient_requests import ResilientRequests
 # ignore warnings during testing
 warnings.filterwarnings('ignore')
 
@@ -48,6 +51,9 @@ def get_initial_args():
         parser.add_argument(
             "-k", "--megaport_key", help="Megaport API Secret Key",
             default=os.environ.get('MEGAPORT_KEY', defaults['megaport_key']))
+        parser.add_argument(
+            "-r", "--run_deadline", help="Seconds the whole run may spend on Megaport API calls", type=float,
+            default=os.environ.get('RUN_DEADLINE', defaults.get('run_deadline', 120)))
         args = parser.parse_args()
 
         # Sanity Check User Input or Env Variables
@@ -63,14 +69,15 @@ def get_initial_args():
             "Arguments parsed successfully. MCR ID: {} | Dry Run?: {} | Prefix List Map: {} | Megaport Token URL: {}".format(args.mcr_id, args.dry_run, args.prefix_list_map, args.megaport_token_url))
         return {'mcr_id': args.mcr_id, 'dry_run': args.dry_run,
                 'prefix_list_map': args.prefix_list_map, 'megaport_token_url': args.megaport_token_url,
-                'megaport_key': args.megaport_key, 'megaport_api_url': args.megaport_api_url}
+                'megaport_key': args.megaport_key, 'megaport_api_url': args.megaport_api_url,
+                'run_deadline': float(args.run_deadline)}
 
     except Exception as e:
         logging.error("Error parsing arguments: ", e)
         exit(1)
 
 
-def megaport_get_token(url, basic_auth) -> str:
+def megaport_get_token(client, url, basic_auth) -> str:
     '''
     Get token from Megaport API
     '''
@@ -81,8 +88,8 @@ def megaport_get_token(url, basic_auth) -> str:
             'Authorization': f'Basic {basic_auth}'
         }
 
-        response = requests.request(
-            "POST", url, headers=headers, data=payload).json()
+        response = client.request(
+            "POST", url, endpoint="megaport:token", headers=headers, data=payload).json()
         logging.info("Got Megaport Token via API")
         return response['access_token']
     except Exception as e:
@@ -90,7 +97,7 @@ def megaport_get_token(url, basic_auth) -> str:
         exit(1)
 
 
-def megaport_get_all_prefix_lists(url, token, mcr_id):
+def megaport_get_all_prefix_lists(client, url, token, mcr_id):
     '''
     Get All Prefix Lists in MCR from Megaport API
     '''
@@ -101,8 +108,8 @@ def megaport_get_all_prefix_lists(url, token, mcr_id):
             'Authorization': f'Bearer {token}'
         }
         payload = {}
-        all_prefix_lists = requests.request(
-            "GET", url, headers=headers, data=payload).json()
+        all_prefix_lists = client.request(
+            "GET", url, endpoint="megaport:prefixLists", headers=headers, data=payload).json()
         logging.info("Got Megaport Prefix Lists")
         return all_prefix_lists['data']
 
@@ -138,9 +145,10 @@ def flatten_list(matrix):
     return flat_list
 
 
-def megaport_get_prefix_list_routes(url, token, mcr_id, prefix_id):
+def megaport_get_prefix_list_routes(client, url, token, mcr_id, prefix_id):
     '''
     Get prefix routes from Megaport API
+    Returns None if the API call fails so the remaining lists can still be synced
     '''
     try:
         current_prefix_list = []
@@ -151,22 +159,29 @@ def megaport_get_prefix_list_routes(url, token, mcr_id, prefix_id):
             'Authorization': f'Bearer {token}'
         }
 
-        current_prefix_data = requests.request(
-            "GET", url, headers=headers, data=payload).json()
+        response = client.request(
+            "GET", url, endpoint="megaport:prefixList", headers=headers, data=payload)
+        response.raise_for_status()
+        current_prefix_data = response.json()
         for subnet in current_prefix_data['data']['entries']:
             current_prefix_list.append(subnet['prefix'])
         logging.info(
             f'Got Prefix List Routes from Megaport API | Prefix ID: {prefix_id}')
         return current_prefix_list
 
+    except (requests.exceptions.RequestException, KeyError, TypeError) as e:
+        logging.error(
+            f'Skipping Prefix List | Prefix ID: {prefix_id} | Error: {e}')
+        return None
     except Exception as e:
         logging.error("Error Getting Megaport Prefix Lists: ", e)
         exit(1)
 
 
-def megaport_update_prefix_list(url, token, mcr_id, prefix_id, list_name, desired_routes):
+def megaport_update_prefix_list(client, url, token, mcr_id, prefix_id, list_name, desired_routes):
     '''
     Update prefix list in Megaport API
+    Returns None if the API call fails so the remaining lists can still be updated
     '''
     try:
         url = f'{url}/product/mcr2/{mcr_id}/prefixList/{prefix_id}'
@@ -179,14 +194,19 @@ def megaport_update_prefix_list(url, token, mcr_id, prefix_id, list_name, desire
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {token}'
         }
-        response = requests.request(
-            "PUT", url, headers=headers, data=payload)
+        response = client.request(
+            "PUT", url, endpoint="megaport:prefixList:update", headers=headers, data=payload)
+        response.raise_for_status()
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(
+                "Unexpected Response: --> {}".format(response.status_code), response=response)
         logging.info(
             f'Updated Prefix List Routes in Megaport API | Prefix ID: {prefix_id} | response: {response.status_code} |\n Payload: {json.dumps(response.json(), indent=4)}')
-        if response.status_code != 200:
-            raise Exception(
-                "Unexpected Response: --> ".format(response.status_code))
         return response
+    except requests.exceptions.RequestException as e:
+        logging.error(
+            f'Failed Updating Prefix List | Prefix ID: {prefix_id} | Error: {e}')
+        return None
     except Exception as e:
         logging.error("Error Updating Megaport Prefix Lists: ", e)
         exit(1)
@@ -201,13 +221,16 @@ if __name__ == "__main__":
     # Get initial arguments from user
     initial_args = get_initial_args()
 
+    # Shared request layer - bounds the run to the deadline budget
+    client = ResilientRequests(deadline=initial_args['run_deadline'], timeout=10)
+
     # Get Megaport Token
     megaport_token = megaport_get_token(
-        initial_args['megaport_token_url'], initial_args['megaport_key'])
+        client, initial_args['megaport_token_url'], initial_args['megaport_key'])
 
     # Get All MP Prefix Lists
     all_megaport_prefix_lists = megaport_get_all_prefix_lists(
-        initial_args['megaport_api_url'], megaport_token, initial_args['mcr_id'])
+        client, initial_args['megaport_api_url'], megaport_token, initial_args['mcr_id'])
 
     # Map MP Prefix List Names to IDs
     pl_name_to_id = {}
@@ -216,6 +239,8 @@ if __name__ == "__main__":
 
     # Plan Changes to be Made
     changes_to_be_made = {}
+    # Prefix lists that could not be read or updated this run
+    failed_prefix_lists = []
 
     for name, pl in initial_args['prefix_list_map'].items():
         desired_subnet_list = []
@@ -227,7 +252,10 @@ if __name__ == "__main__":
 
         flattened_desired_list = flatten_list(desired_subnet_list)
         current_prefix_list = megaport_get_prefix_list_routes(
-            initial_args['megaport_api_url'], megaport_token, initial_args['mcr_id'], pl_name_to_id[name])
+            client, initial_args['megaport_api_url'], megaport_token, initial_args['mcr_id'], pl_name_to_id[name])
+        if current_prefix_list is None:
+            failed_prefix_lists.append(name)
+            continue
 
         set_diff_add = set(flattened_desired_list) - set(current_prefix_list)
         set_diff_del = set(current_prefix_list) - set(flattened_desired_list)
@@ -251,9 +279,18 @@ if __name__ == "__main__":
         for prefix_list in changes_to_be_made:
             if len(changes_to_be_made[prefix_list]['routes_to_add']) == 0 and len(changes_to_be_made[prefix_list]['routes_to_delete']) == 0:
                 continue
-            megaport_update_prefix_list(
+            response = megaport_update_prefix_list(
+                client,
                 initial_args['megaport_api_url'],
                 megaport_token, initial_args['mcr_id'],
                 changes_to_be_made[prefix_list]['prefix_id'],
                 changes_to_be_made[prefix_list]['description'],
                 changes_to_be_made[prefix_list]['desired'])
+            if response is None:
+                failed_prefix_lists.append(prefix_list)
+
+    # Other prefix lists were synced above, still flag the run as failed
+    if failed_prefix_lists:
+        logging.error(
+            f'Prefix Lists Failed to Sync: {", ".join(failed_prefix_lists)}')
+        exit(1)